@@ -4,72 +4,272 @@ import os
 import os.path
 import argparse
 import mutagen.flac
-import hashlib
-from collections import OrderedDict
+import stat
+import struct
+import time
+import functools
+import queue
+import threading
+from array import array
+from collections import Counter, deque
 
 sys.stdout = io.TextIOWrapper(sys.stdout.detach(), sys.stdout.encoding, 'replace')
 
+STAT_FROM_DIR = os.name == 'nt'  # windows returns file sizes with the directory listing
+DEFAULT_JOBS = min(4, os.cpu_count() or 1)  # more workers mostly add seeking on spinning disks
+SKIP_DIRS = {'__MACOSX'}  # never holds music, only resource forks
+WRITE_CHUNK = 64 * 1024  # small enough to still be in cache when it gets hashed
+READAHEAD_SIZE = 4 * 1024 * 1024  # covers the metadata blocks of nearly all flacs, audio is only read when resized
+MAX_BLOCK_SIZE = 2 ** 24 - 1  # flac metadata block lengths are 24 bit
+SEPARATOR = '-' * 36
+PREFIXES = ('', 'Ki', 'Mi', 'Gi', 'Ti', 'Pi', 'Ei', 'Zi')
+READ_FLAGS = os.O_RDONLY | getattr(os, 'O_BINARY', 0) | getattr(os, 'O_CLOEXEC', 0)
+WRITE_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0) | getattr(os, 'O_CLOEXEC', 0)
+
 
 class FlacProps:
     """
     stores properties of a flac obj
     """
-    def __init__(self, flac_type, base_path):
-        self.filename = flac_type.filename
+    __slots__ = ('filename', 'base_path', 'file_size', '_id3_headers', 'pic_list', 'pad_list')
+
+    def __init__(self, filename, base_path, file_size, pic_list, pad_list):
+        self.filename = filename
         self.base_path = base_path
-        file_stats = os.stat(self.filename)
-        self.file_size = file_stats.st_size
+        self.file_size = file_size
         self._id3_headers = None
-        self.pic_list = []
-        self.pad_list = []
+        self.pic_list = pic_list
+        self.pad_list = pad_list
+
+    @classmethod
+    def from_flac(cls, flac_type, base_path, file_size=None):
+        """
+        :param flac_type: mutagen Flac obj.
+        :param base_path: str.
+        :param file_size: int. or None to stat the file
+        """
+        if file_size is None:
+            file_size = os.stat(flac_type.filename).st_size
+        pic_list = []
+        pad_list = []
         for block in flac_type.metadata_blocks:
             if block.code == 6:
-                self.pic_list.append((len(block.data), block.width, block.height))
+                pic_list.append((len(block.data), block.width, block.height))
             if block.code == 1:
-                self.pad_list.append(block.length)
+                pad_list.append(block.length)
+        return cls(flac_type.filename, base_path, file_size, pic_list, pad_list)
 
-    def check_id3_header(self):
+    @classmethod
+    def from_file(cls, filename, base_path, file_size):
         """
-        Looks for id3v1 and v2 headers in files
-        :return: list of found header names (strings)
+        Reads only the metadata block headers and picture dimensions, seeking over everything else.
+        Like mutagen, vorbis comments and pictures are measured by their content, since some
+        taggers write wrong block lengths for them.
+        :raise ValueError, struct.error: on anything unexpected, leave those files to mutagen
         """
-        with open(self.filename, 'rb') as fileobj:
-            header_type = []
-            fileobj.seek(0)
-            header = fileobj.read(3)
-            if header == b"ID3":
-                header_type.append('id3v2')
-            fileobj.seek(-128, 2)
-            header_v1 = fileobj.read(3)
-            if header_v1 == b'TAG':
-                header_type.append('id3v1')
-            self._id3_headers = header_type
+        pic_list = []
+        pad_list = []
+        with open(filename, 'rb') as fileobj:
+            header = fileobj.read(10)
+            flac_start = 0
+            if header[:3] == b'ID3':  # id3v2 size is 4 syncsafe bytes
+                flac_start = 10 + sum(byte << 7 * (3 - i) for i, byte in enumerate(header[6:10]))
+            fileobj.seek(flac_start)
+            if fileobj.read(4) != b'fLaC':
+                raise ValueError('no flac header')
+            has_streaminfo = False
+            is_last = False
+            while not is_last:
+                block_header = read_struct(fileobj, '>I')
+                is_last = block_header >> 31
+                code = block_header >> 24 & 0x7F
+                length = block_header & 0xFFFFFF
+                if code == 0:
+                    has_streaminfo = True
+                if code == 4:  # vorbis comment, little endian lengths
+                    fileobj.seek(read_struct(fileobj, '<I'), 1)
+                    for _ in range(read_struct(fileobj, '<I')):
+                        fileobj.seek(read_struct(fileobj, '<I'), 1)
+                elif code == 6:
+                    fileobj.seek(read_struct(fileobj, '>4xI'), 1)  # mime
+                    fileobj.seek(read_struct(fileobj, '>I'), 1)  # description
+                    width, height, data_len = read_struct(fileobj, '>II8xI')
+                    pic_list.append((data_len, width, height))
+                    fileobj.seek(data_len, 1)
+                else:
+                    if code == 1:
+                        pad_list.append(length)
+                    fileobj.seek(length, 1)
+            if not has_streaminfo or fileobj.tell() > file_size:
+                raise ValueError('broken metadata')
+        return cls(filename, base_path, file_size, pic_list, pad_list)
+
+
+def read_struct(fileobj, fmt):
+    """
+    :return: the value unpacked from the next bytes of fileobj, or a tuple of them
+    """
+    values = struct.unpack(fmt, fileobj.read(struct.calcsize(fmt)))
+    return values if len(values) > 1 else values[0]
 
 
-def list_all_files(input_paths):
+def read_at(fd, size, offset):
+    """
+    reads size bytes from fd at offset, without seeking where pread is available
+    """
+    if hasattr(os, 'pread'):
+        return os.pread(fd, size, offset)
+    os.lseek(fd, offset, os.SEEK_SET)
+    return os.read(fd, size)
+
+
+def probe_file(file_path, file_size=None, details=True, readahead=False):
+    """
+    Gets what mutagen doesn't tell us with a single open: flac magic, file size and id3 headers.
+    :param file_path: str.
+    :param file_size: int. or None to fstat the open file
+    :param details: bool. False only checks the magic, size and headers are returned as found
+    :param readahead: bool. ask the kernel to start reading the metadata region in the background
+    :return: (file size, list of found id3 header names), None for non flac files
+    """
+    fd = os.open(file_path, READ_FLAGS)
+    try:
+        magic = read_at(fd, 4, 0)
+        if magic != b'fLaC' and magic[:3] != b'ID3':  # skips covers, logs etc. without a mutagen parse
+            return None
+        if readahead and hasattr(os, 'posix_fadvise'):  # not on windows and macos
+            os.posix_fadvise(fd, 0, READAHEAD_SIZE, os.POSIX_FADV_WILLNEED)
+        if not details:
+            return file_size, None
+        if file_size is None:
+            file_size = os.fstat(fd).st_size
+        header_type = []
+        if magic[:3] == b'ID3':
+            header_type.append('id3v2')
+        if file_size >= 4 + 128 and read_at(fd, 3, file_size - 128) == b'TAG':  # room for magic and a tag
+            header_type.append('id3v1')
+    finally:
+        os.close(fd)
+    return file_size, header_type
+
+
+def iter_all_files(dirpath):
     """
-    create list of all files in dirpath + subfolders
+    yields (path, size) of all non hidden files in dirpath + subfolders, in os.walk order.
+    size is None when it would cost an extra stat
+    """
+    dir_stack = [dirpath]
+    while dir_stack:
+        sub_dirs = []
+        try:
+            entries = os.scandir(dir_stack.pop())
+        except OSError:  # unreadable folders are skipped, like os.walk does
+            continue
+        with entries:
+            for entry in entries:
+                if entry.name.startswith('.'):  # hidden files and folders: .git, ._ resource forks etc.
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in SKIP_DIRS:
+                        sub_dirs.append(entry.path)
+                elif entry.is_file():  # only needs a stat for symlinks
+                    yield entry.path, entry.stat().st_size if STAT_FROM_DIR else None
+        dir_stack.extend(reversed(sub_dirs))
+
+
+def iter_input_files(input_paths):
+    """
+    :param input_paths: str. or list of strings
+    :return: iterator of (path, size) of all files in input_paths + subfolders, list of valid input paths
     """
-    rough_list = []
     if isinstance(input_paths, str):  # allows for string input when used as a module
         input_paths = [input_paths]
+    input_stats = {}  # one stat per input path, reused for its type and size
     for path in input_paths:
-        if os.path.isfile(path):
-            rough_list.append(path)
-        elif os.path.isdir(path):
-            for root, dirs, files in os.walk(path):
-                for x in files:
-                    rough_list.append(os.path.join(root, x))
-    if not rough_list:
+        try:
+            path_stat = os.stat(path)
+        except (OSError, ValueError):
+            continue
+        if stat.S_ISREG(path_stat.st_mode) or stat.S_ISDIR(path_stat.st_mode):
+            input_stats[path] = path_stat
+    if not input_stats:
         raise Exception('No valid path entered')
-    clean_list = list(OrderedDict.fromkeys(rough_list))  # removes dupes while keeping order
-    common_path = os.path.commonpath(clean_list)
+    valid_paths = list(input_stats)
+
+    def walk():
+        seen = set()
+        found = False
+        for path, path_stat in input_stats.items():
+            if stat.S_ISDIR(path_stat.st_mode):
+                files = iter_all_files(path)
+            else:
+                files = [(path, path_stat.st_size)]
+            for file_path, file_size in files:
+                if len(valid_paths) > 1:  # overlapping input paths could give dupes
+                    if file_path in seen:
+                        continue
+                    seen.add(file_path)
+                found = True
+                yield file_path, file_size
+        if not found:  # only empty folders
+            raise Exception('No valid path entered')
+
+    return walk(), valid_paths
+
+
+def get_base_path(paths):
+    """
+    :param paths: list of valid input paths
+    :return: path that printed file names are relative to
+    """
+    if len(paths) == 1:  # no need to compare anything
+        return paths[0]
+    return os.path.commonpath(paths)
 
-    return clean_list, common_path
 
+def get_fingerprint(pic_obj):
+    """
+    identifies a picture by its dimensions, size and its first and last 64 bytes, without hashing anything.
+    pictures with the same fingerprint still get a full content check
+    """
+    data = pic_obj.data
+    return pic_obj.width, pic_obj.height, len(data), data[:64], data[-64:]
+
+
+def new_hash(name):
+    """
+    hash objects are only used for deduplication, which lets FIPS builds of OpenSSL use their fast path
+    """
+    import hashlib  # only needed when saving pictures
+    try:
+        return hashlib.new(name, usedforsecurity=False)
+    except TypeError:  # python < 3.9
+        return hashlib.new(name)
 
-def get_md5(data):
-    hash_obj = hashlib.md5(data)
+
+@functools.lru_cache(maxsize=None)
+def content_hash_name():
+    """
+    Picks the faster of sha256 (sha-ni through openssl on most cpus) and blake2b on this machine.
+    Measured once per run, so all digests of a run are comparable.
+    """
+    sample = bytes(256 * 1024)
+    timings = {}
+    for name in ('sha256', 'blake2b'):
+        new_hash(name).update(sample)  # untimed warm up, the first call also imports hashlib
+        start = time.perf_counter()
+        for _ in range(4):
+            new_hash(name).update(sample)
+        timings[name] = time.perf_counter() - start
+    return min(timings, key=timings.get)
+
+
+def get_content_digest(data):
+    """
+    full content hash, only needed when two pictures have the same fingerprint
+    """
+    hash_obj = new_hash(content_hash_name())
+    hash_obj.update(data)
     return hash_obj.digest()
 
 
@@ -79,138 +279,205 @@ def proper_prefix(num, suffix='B'):
     :param suffix: unit of choice
     :return: string of size with appropriate prefix
     """
-    for prefix in ['', 'Ki', 'Mi', 'Gi', 'Ti', 'Pi', 'Ei', 'Zi']:
-        if abs(num) < 1024:
-            return '{:.1f} {}{}'.format(num, prefix, suffix)
-        num /= 1024
-    return "too big"
+    size = abs(num)
+    if size < 1024:
+        return f'{num:.1f} {suffix}'
+    exponent = min((int(size).bit_length() - 1) // 10, len(PREFIXES) - 1)  # every prefix is 10 bits
+    return f'{num / (1 << 10 * exponent):.1f} {PREFIXES[exponent]}{suffix}'
 
 
-def print_if_true(test, txt):
+def append_if_true(lines, test, txt):
     if test:
-        print(txt)
+        lines.append(txt)
 
 
-def print_check(fstats_before):
+def write_lines(lines):
+    """
+    one write per block of output instead of one print per line
+    """
+    sys.stdout.write('\n'.join(lines) + '\n')
 
+
+@functools.lru_cache(maxsize=1024)
+def cached_relpath(location, base_path):
+    """
+    relpath calls abspath (and so getcwd) on both paths; tracks of an album share their location
+    """
+    return os.path.relpath(location or os.curdir, base_path or os.curdir)
+
+
+def check_lines(fstats_before):
+    """
+    :type fstats_before: FlacProps
+    :return: list of output lines
+    """
     if fstats_before.filename == fstats_before.base_path:
         print_path = os.path.split(fstats_before.base_path)[1]
     else:
-        print_path = os.path.relpath(fstats_before.filename, fstats_before.base_path)
-    print('-' * 36)
-    print('{} ({})'.format(print_path, proper_prefix(fstats_before.file_size)))
+        location, name = os.path.split(fstats_before.filename)
+        rel_location = cached_relpath(location, fstats_before.base_path)
+        print_path = name if rel_location == os.curdir else os.path.join(rel_location, name)
+    lines = [SEPARATOR, '{} ({})'.format(print_path, proper_prefix(fstats_before.file_size))]
     for header in fstats_before._id3_headers:
-        print(' {} tags'.format(header))
+        lines.append(' {} tags'.format(header))
     if fstats_before.pic_list:
         for pic in fstats_before.pic_list:
-            print(' Picture ({} x {}) {}'.format(pic[1], pic[2], proper_prefix(pic[0])))
+            lines.append(' Picture ({} x {}) {}'.format(pic[1], pic[2], proper_prefix(pic[0])))
     else:
-        print(' No pictures found')
+        lines.append(' No pictures found')
     if fstats_before.pad_list:
         for block in fstats_before.pad_list:
-            print(' Padding block: {}'.format(proper_prefix(block)))
+            lines.append(' Padding block: {}'.format(proper_prefix(block)))
     else:
-        print(' No padding found')
+        lines.append(' No padding found')
+    return lines
 
 
-def print_results(track_info):
+def result_lines(track_info):
     """
     :type track_info: tuple of two FlacProp instances
+    :return: list of output lines
     """
     fstats_before, fstats_after = track_info
-    print()
+    lines = ['']
     if not fstats_after.pic_list:
-        if fstats_before.pic_list:
-            print(' Pictures succesfully removed')
+        append_if_true(lines, fstats_before.pic_list, ' Pictures succesfully removed')
     else:
-        print(' {} pictures remaining'.format(len(fstats_after.pic_list)))
-    if sum(fstats_after.pad_list) != sum(fstats_before.pad_list):
-        print(' New padding: {}'.format(proper_prefix(sum(fstats_after.pad_list))))
+        lines.append(' {} pictures remaining'.format(len(fstats_after.pic_list)))
+    padding_after = sum(fstats_after.pad_list)
+    if padding_after != sum(fstats_before.pad_list):
+        lines.append(' New padding: {}'.format(proper_prefix(padding_after)))
     else:
-        print(' Padding was left as found: {}'.format(proper_prefix(sum(fstats_after.pad_list))))
+        lines.append(' Padding was left as found: {}'.format(proper_prefix(padding_after)))
     file_size_change = fstats_after.file_size - fstats_before.file_size
-    print_if_true(file_size_change < 0, ' File size reduction: {}'.format(proper_prefix(abs(file_size_change))))
-    print_if_true(file_size_change > 0, ' File size increase: {}'.format(proper_prefix(file_size_change)))
+    append_if_true(lines, file_size_change < 0,
+                   ' File size reduction: {}'.format(proper_prefix(abs(file_size_change))))
+    append_if_true(lines, file_size_change > 0, ' File size increase: {}'.format(proper_prefix(file_size_change)))
+    return lines
 
 
 def print_footer(ind_changes_list):
     """
-    :param ind_changes_list: list
+    :param ind_changes_list: sequence of ints (array or list)
     """
-    total_min = sum([abs(x) for x in ind_changes_list if x < 0])
-    total_plus = sum([x for x in ind_changes_list if x > 0])
-    print('-' * 36)
+    total_min = total_plus = 0
+    for x in ind_changes_list:  # one pass, no temporary lists
+        if x < 0:
+            total_min -= x
+        elif x > 0:
+            total_plus += x
+    lines = [SEPARATOR]
     if len(ind_changes_list) > 1:
-        print()
-        print_if_true(total_min, 'A total of {} was removed'.format(proper_prefix(total_min)))
-        print_if_true(total_plus, 'A total of {} was added'.format(proper_prefix(total_plus)))
+        lines.append('')
+        append_if_true(lines, total_min, 'A total of {} was removed'.format(proper_prefix(total_min)))
+        append_if_true(lines, total_plus, 'A total of {} was added'.format(proper_prefix(total_plus)))
+    write_lines(lines)
 
 
-def padding_wrapper(padding_args):
-    def padding_rules(y, size=padding_args[0], up=padding_args[1], low=padding_args[2]):
+class PaddingRule:
+    """
+    Inserted into mutagen as padding function, with size and the range of padding to keep in bytes.
+    Remembers what it returned, so the new padding is known without reading the file again.
+    """
+    def __init__(self, size, keep):
+        self.size = size
+        self.keep = keep
+        self.last_padding = None
+
+    def __call__(self, y):
         """
-        This function is inserted into mutagen.
         y is a PaddingInfo object which has two attributes:
         y.padding = padding size (better said: amount of unused space between header and audio.
         y.size = size of music content  (not used here)
         """
-        if 1024 * low <= y.padding <= 1024 * up:
-            return y.padding
+        if y.padding in self.keep:
+            self.last_padding = y.padding
         else:
-            return 1024 * size
-    return padding_rules
+            self.last_padding = self.size
+        return self.last_padding
 
 
-def make_save_path(mime, flac_filename, loc_list):
+def padding_wrapper(padding_args):
+    """
+    :param padding_args: tupple of 3 padding settings in KiB
+    :return: PaddingRule, built once per run
+    """
+    size, up, low = padding_args
+    # int range membership is a constant time check in C
+    return PaddingRule(1024 * size, range(1024 * low, 1024 * up + 1))
+
+
+def make_save_path(mime, location, loc_counter):
     """
     :param mime: str.
-    :param flac_filename: str.
-    :param loc_list: list of used picture save locations
+    :param location: str. folder of the flac
+    :param loc_counter: Counter of used picture save locations
+    :return: save path, fd of the newly created (never overwritten) file
     """
     try:
         extension = mime.split('/')[1].replace('jpeg', 'jpg')
     except IndexError:
         extension = 'pic'
-    location = os.path.dirname(flac_filename)
-    count = loc_list.count(location) + 1
-    loc_list.append(location)
-    save_path = os.path.join(location, 'cover{}.{}'.format(count, extension)).replace('cover1.', 'cover.')
-    while os.path.isfile(save_path):
-        loc_list.append(location)
-        count += 1
-        save_path = os.path.join(location, 'cover{}.{}'.format(count, extension))
-    return save_path
-
-
-def save_pictures(flac, saved_pics, loc_list):
+    loc_counter[location] += 1
+    count = loc_counter[location]
+    save_path = os.path.join(location, 'cover{}.{}'.format(count if count > 1 else '', extension))
+    while True:
+        try:  # O_EXCL doubles as the existence check
+            return save_path, os.open(save_path, WRITE_FLAGS, 0o644)
+        except FileExistsError:
+            loc_counter[location] += 1
+            count = loc_counter[location]
+            save_path = os.path.join(location, 'cover{}.{}'.format(count, extension))
+
+
+def save_pictures(flac_filename, pictures, saved_pics, loc_counter):
     """
-    :param flac: mutagen Flac obj.
-    :param saved_pics: set of tupples: {(size, checksum), ...}
-    :param loc_list: list of used pic. save locations
+    :param flac_filename: str. the pictures are saved next to this file
+    :param pictures: list of tupples: [(fingerprint, mime, data), ...]
+    :param saved_pics: dict: {(width, height, size, head, tail): {save path: content digest}, ...}
+    :param loc_counter: Counter of used pic. save locations
     """
-    for pic_obj in flac.pictures:
-        checksum = get_md5(pic_obj.data)
-        if checksum in saved_pics:
-            pass
-        else:
-            saved_pics.add(checksum)
-            save_path = make_save_path(pic_obj.mime, flac.filename, loc_list)
-            with open(save_path, 'wb') as new_file:
-                new_file.write(pic_obj.data)
-
-
-def track_work(file_path, base_path, padding_args, checkonly, keep_id3, keep_pic, pic_save, saved_pics, loc_list):
+    location = os.path.dirname(flac_filename)
+    for fingerprint, mime, data in pictures:
+        same_prints = saved_pics.setdefault(fingerprint, {})
+        if same_prints and get_content_digest(data) in same_prints.values():
+            continue
+        save_path, fd = make_save_path(mime, location, loc_counter)
+        hash_obj = new_hash(content_hash_name())
+        data_view = memoryview(data)
+        try:  # hashing each chunk as it is written saves a second pass over the data
+            for start in range(0, len(data_view), WRITE_CHUNK):
+                chunk = data_view[start:start + WRITE_CHUNK]
+                hash_obj.update(chunk)
+                while chunk:  # os.write may write less than it was given
+                    chunk = chunk[os.write(fd, chunk):]
+        finally:
+            os.close(fd)
+        same_prints[save_path] = hash_obj.digest()
+
+
+def load_track(file_path, file_size, base_path, checkonly, silent):
     """
+    the reading half of the work on a file
     :param file_path: str. file to be processed
+    :param file_size: int. or None if unknown
     :param base_path: str. path that fed into the script
-    :param padding_args: tupple of 3 padding settings
-    :param keep_pic: bool.
-    :param keep_id3: bool.
-    :param checkonly: bool.
-    :param checkonly, silent, keep_id3, keep_pic, pic_save: bool.
-    :param saved_pics: set of tupples: {(size, checksum), ...}
-    :param loc_list: list of used pic. save locations
+    :param checkonly, silent: bool.
+    :return: (file_path, mutagen flac or None if not needed, FlacProps or None when silent), None for non flacs
     """
+    # with --jobs 1 this runs ahead of fix_track, so the kernel reads while the previous file is saved
+    probe = probe_file(file_path, file_size, details=not silent, readahead=not checkonly)  # silent runs report nothing
+    if not probe:
+        return
+    file_size, id3_headers = probe
+    if checkonly and not silent:
+        try:  # no need to have mutagen read all tags and pictures
+            fstats_before = FlacProps.from_file(file_path, base_path, file_size)
+        except (ValueError, struct.error):
+            pass
+        else:
+            fstats_before._id3_headers = id3_headers
+            return file_path, None, fstats_before
     try:
         flac = mutagen.flac.FLAC(file_path)
 
@@ -223,26 +490,188 @@ def track_work(file_path, base_path, padding_args, checkonly, keep_id3, keep_pic
         else:
             raise err
 
-    fstats_before = FlacProps(flac, base_path)
-    fstats_before.check_id3_header()
+    fstats_before = None
+    if not silent:
+        fstats_before = FlacProps.from_flac(flac, base_path, file_size)
+        fstats_before._id3_headers = id3_headers
+    return file_path, flac, fstats_before
+
+
+def fix_track(loaded, padding, checkonly, silent, keep_id3, keep_pic):
+    """
+    the writing half of the work on a file, pictures to be saved must be on disk by now
+    :param loaded: return value of load_track
+    :param padding: PaddingRule from padding_wrapper
+    :param checkonly, silent, keep_id3, keep_pic: bool.
+    :return: (file_path, FlacProps before, FlacProps after), None for non flacs. FlacProps are None when silent
+    """
+    if not loaded:
+        return
+    file_path, flac, fstats_before = loaded
     if checkonly:
-        return fstats_before, None
-    if fstats_before.pic_list:
-        if pic_save:
-            save_pictures(flac, saved_pics, loc_list)
-        if not keep_pic:
-            flac.clear_pictures()
-    delete_id3 = False
-    if fstats_before._id3_headers and not keep_id3:
-        delete_id3 = True
-    flac.save(padding=padding_wrapper(padding_args), deleteid3=delete_id3)
-    flac.load(flac.filename)
-    fstats_after = FlacProps(flac, base_path)
-    return fstats_before, fstats_after
+        return file_path, fstats_before, None
+    if flac.pictures and not keep_pic:
+        flac.clear_pictures()
+    flac.save(padding=padding, deleteid3=not keep_id3)  # mutagen looks for the tags itself
+    fstats_after = None
+    if not silent:  # mutagen writes exactly one padding block and the pictures still in flac
+        pad_list = [min(padding.last_padding, MAX_BLOCK_SIZE)]
+        fstats_after = FlacProps(file_path, fstats_before.base_path, os.stat(file_path).st_size,
+                                 fstats_before.pic_list if keep_pic else [], pad_list)
+    return file_path, fstats_before, fstats_after
+
+
+def get_pictures(flac):
+    """
+    :param flac: mutagen Flac obj.
+    :return: list of (fingerprint, mime, data) tupples, the picklable part save_pictures needs
+    """
+    return [(get_fingerprint(pic_obj), pic_obj.mime, pic_obj.data) for pic_obj in flac.pictures]
+
+
+def picture_work(file_path, file_size, load):
+    """
+    Runs in the worker processes ahead of track_work when pictures are saved.
+    :param file_path: str. file to be processed
+    :param file_size: int. or None if unknown
+    :param load: partial of load_track
+    :return: (file_path, file_size, pictures to save), None for non flacs
+    """
+    loaded = load(file_path, file_size)
+    if loaded:
+        return file_path, file_size, get_pictures(loaded[1])
+
+
+def saved_first(picture_results, save):
+    """
+    :param picture_results: iterator of picture_work results
+    :param save: callable taking a file path and its pictures
+    :return: iterator of (path, size) tuples of flacs whose pictures are on disk
+    """
+    for picture_result in picture_results:
+        if not picture_result:
+            continue
+        file_path, file_size, pictures = picture_result
+        if pictures:
+            save(file_path, pictures)
+        yield file_path, file_size
+
+
+def track_work(file_path, file_size, load, fix):
+    """
+    Runs in the worker processes, so it gets and returns only picklable data.
+    :param file_path: str. file to be processed
+    :param file_size: int. or None if unknown
+    :param load: partial of load_track
+    :param fix: partial of fix_track
+    :return: see fix_track
+    """
+    return fix(load(file_path, file_size))
+
+
+def iter_ahead(executor, func, work_iter, ahead, drain=True):
+    """
+    :param executor: concurrent.futures executor
+    :param func: callable taking the items of work_iter as arguments
+    :param work_iter: iterator of argument tuples
+    :param ahead: int. number of calls to have submitted beyond the one being waited on
+    :param drain: bool. on an error, still yield the results of the calls that were already running
+    :return: iterator of results, in work_iter order
+    """
+    pending = deque()
+    try:
+        for work_args in work_iter:
+            pending.append(executor.submit(func, *work_args))
+            if len(pending) > ahead:  # don't let the walk run far ahead of the executor
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    except Exception:  # stop at a failing file like a serial run, but report the ones that were already running
+        for future in pending:
+            future.cancel()
+        for future in pending:
+            if drain and not future.cancelled() and not future.exception():
+                yield future.result()
+        raise
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def iter_prefetched(load, work_iter):
+    """
+    :param load: callable taking the items of work_iter as arguments
+    :param work_iter: iterator of argument tuples
+    :return: iterator of results, in work_iter order. a reader thread loads the next one in the meantime
+    """
+    loaded = queue.Queue(maxsize=1)
+    stop = threading.Event()
+
+    def reader():
+        try:
+            for work_args in work_iter:
+                if stop.is_set():
+                    return
+                loaded.put((load(*work_args), None))
+            loaded.put(None)
+        except BaseException as err:  # raised again in the main thread
+            loaded.put((None, err))
+
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = loaded.get()
+            if item is None:
+                return
+            result, err = item
+            if err is not None:
+                raise err
+            yield result
+    finally:
+        stop.set()
+        while thread.is_alive():  # the reader may be waiting for room in the queue
+            try:
+                loaded.get_nowait()
+            except queue.Empty:
+                pass
+            thread.join(0.1)
+
+
+def run_jobs(load, fix, save, work_iter, jobs):
+    """
+    Pictures are saved before their flac is changed, so a failing run never loses them.
+    :param load: picklable partial of load_track
+    :param fix: picklable partial of fix_track
+    :param save: callable taking a file path and its pictures, None when no pictures are saved
+    :param work_iter: iterator of (path, size) tuples
+    :param jobs: int. number of worker processes, with 1 a thread reads the next file while this one is saved
+    :return: iterator of fix_track results, in work_iter order
+    """
+    if jobs < 2:
+        for loaded in iter_prefetched(load, work_iter):
+            if save and loaded and loaded[1]:
+                save(loaded[0], get_pictures(loaded[1]))
+            yield fix(loaded)
+        return
+    from concurrent.futures import ProcessPoolExecutor  # pulls in logging and multiprocessing
+    work = functools.partial(track_work, load=load, fix=fix)
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        if not save:
+            yield from iter_ahead(executor, work, work_iter, jobs)
+            return
+        # saving needs the state of the whole run, so the workers read the pictures, this process saves them and
+        # only then are the flacs handed out again to be fixed
+        picture_results = iter_ahead(executor, functools.partial(picture_work, load=load), work_iter, jobs,
+                                     drain=False)
+        try:
+            yield from iter_ahead(executor, work, saved_first(picture_results, save), jobs)
+        finally:
+            picture_results.close()
 
 
 def main(input_path, pd_sz=8, up_thr=20, lw_thr=4,
-         checkonly=False, silent=False, keepid3=False, keep_pic=False, pic_save=False):
+         checkonly=False, silent=False, keepid3=False, keep_pic=False, pic_save=False, jobs=1):
     """
     :param input_path: str. or list of strings
     :param pd_sz: int.
@@ -253,24 +682,34 @@ def main(input_path, pd_sz=8, up_thr=20, lw_thr=4,
     :param keepid3: bool.
     :param keep_pic: bool.
     :param pic_save: bool.
+    :param jobs: int. number of files processed at the same time
     :return: nothing
     """
-    work_list, base_path = list_all_files(input_path)
-    ind_change_list = []
-    saved_pics = set()
-    loc_list = []
-
-    for file_path in work_list:
-        track_info = track_work(file_path, base_path, (pd_sz, up_thr, lw_thr),
-                                checkonly, keepid3, keep_pic, pic_save, saved_pics, loc_list)
+    work_iter, valid_paths = iter_input_files(input_path)
+    base_path = None if silent else get_base_path(valid_paths)  # only used for printing
+    ind_change_list = array('q')  # packed 8 byte ints, large libraries add one per file
+    saved_pics = {}
+    loc_counter = Counter()
+
+    load = functools.partial(load_track, base_path=base_path, checkonly=checkonly, silent=silent)
+    fix = functools.partial(fix_track, padding=padding_wrapper((pd_sz, up_thr, lw_thr)), checkonly=checkonly,
+                            silent=silent, keep_id3=keepid3, keep_pic=keep_pic)
+    save = None
+    if pic_save and not checkonly:
+        save = functools.partial(save_pictures, saved_pics=saved_pics, loc_counter=loc_counter)
+
+    for track_info in run_jobs(load, fix, save, work_iter, jobs):
         if not track_info:  # non flacs
             continue
+        file_path, fstats_before, fstats_after = track_info
+        if silent:
+            continue
+        if not checkonly:
+            ind_change_list.append(fstats_after.file_size - fstats_before.file_size)
+        lines = check_lines(fstats_before)
         if not checkonly:
-            ind_change_list.append(track_info[1].file_size - track_info[0].file_size)
-        if not silent:
-            print_check(track_info[0])
-            if not checkonly:
-                print_results(track_info)
+            lines += result_lines((fstats_before, fstats_after))
+        write_lines(lines)
 
     if not silent:
         print_footer(ind_change_list)
@@ -298,7 +737,9 @@ if __name__ == "__main__":
                              ' Upper default = 20')
     parser.add_argument('-l', dest='lower', metavar='KiB', type=int, default=4,
                         help='Lower threshold. Default = 4')
+    parser.add_argument('-j', '--jobs', metavar='N', type=int, default=DEFAULT_JOBS,
+                        help='Number of files processed at the same time. Default = {}'.format(DEFAULT_JOBS))
 
     args = parser.parse_args()
     main(args.path, args.pad_size, args.upper, args.lower, args.checkonly,
-         args.silent, args.keepid3, args.keep_pic, args.pics2disc)
+         args.silent, args.keepid3, args.keep_pic, args.pics2disc, args.jobs)